@@ -5,7 +5,9 @@ Created: 15-Nov-2025 by Paulo Miguel
 Count mutations in CCDS regions split by SAE, SCE or normal.
 """
 
+import numpy as np
 import pandas as pd
+from prep_ref_files import load_ref
 
 
 def add_mutation_counts(intervals_df, mutations_df):
@@ -23,40 +25,43 @@ def add_mutation_counts(intervals_df, mutations_df):
     not_matched_df: Pandas DataFrame containing each of the mutations that did not fit within the genomic intervals
     """
 
-    not_matched_df = pd.DataFrame({"chrom": [], 'position': [], 'gene': [], 'type': []})
-    
-    intervals_df['silent_count'] = 0
-    intervals_df['missense_count'] = 0 
-
-    mutations_index = 0
-    mutations_len = len(mutations_df)
-
-    # Iterate through the intervals
-    for index, row in intervals_df.iterrows():
-
-        # If this is not the last mutation and the mutation occurs before the current interval
-        while mutations_index < mutations_len and mutations_df.iloc[mutations_index]['Start_Position']-1 < row['start']:
-            
-            # Save the mutation to the not matched DataFrame, since it does not fall within an interval
-            mutations_row = mutations_df.iloc[mutations_index]
-            not_matched_df.loc[len(not_matched_df)] = [mutations_row['Chromosome'], mutations_row['Start_Position']-1, mutations_row['Hugo_Symbol'], mutations_row['Variant_Classification']]
-            
-            # Iterate the mutation index to get the next mutation
-            mutations_index += 1
-
-        # If this is not the last mutation and the mutation is located within the interval
-        while mutations_index < mutations_len and \
-            mutations_df.iloc[mutations_index]['Start_Position']-1 in range(int(row['start']), int(row['end'])+1):
-
-            # If the mutation is silent, add 1 to the silent count for the interval
-            if mutations_df.iloc[mutations_index]['Variant_Classification'] == 'Silent':
-                intervals_df.at[index, 'silent_count'] += 1
-            # If the mutation if missense, add 1 to the missense count for the interval
-            elif mutations_df.iloc[mutations_index]['Variant_Classification'] == 'Missense_Mutation':
-                intervals_df.at[index, 'missense_count'] += 1
-
-            # Iterate the mutation index to get the next mutation
-            mutations_index += 1
+    # Extract the interval boundaries as NumPy arrays
+    starts = intervals_df['start'].to_numpy()
+    ends = intervals_df['end'].to_numpy()
+
+    # Extract the mutation columns, converting the positions to 0-based positions to match the
+    # intervals (classifications stay categorical so they are compared by their codes)
+    positions = mutations_df['Start_Position'].to_numpy() - 1
+    classifications = mutations_df['Variant_Classification']
+    chromosomes = mutations_df['Chromosome'].to_numpy()
+    genes = mutations_df['Hugo_Symbol'].to_numpy()
+
+    # Count the mutations of each type that fall within each interval using binary searches on
+    # the sorted mutation positions (mutations with start <= position <= end)
+    counts = {}
+    for column, classification in [('silent_count', 'Silent'), ('missense_count', 'Missense_Mutation')]:
+        class_positions = positions[classifications.eq(classification).to_numpy()]
+        counts[column] = np.searchsorted(class_positions, ends, side='right') - np.searchsorted(class_positions, starts, side='left')
+
+    # Add both count columns to the intervals in a single step
+    intervals_df = intervals_df.assign(**counts)
+
+    # Sort the intervals by start and keep the furthest end reached so far, so that overlapping
+    # or out of order intervals are handled
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    furthest_ends = np.maximum.accumulate(ends[order])
+
+    # Find the last interval starting at or before each mutation, the mutation does not fit within
+    # an interval if there is no such interval or if all of those intervals end before the mutation
+    interval_index = np.searchsorted(sorted_starts, positions, side='right') - 1
+    not_matched = (interval_index < 0) | (positions > furthest_ends[np.maximum(interval_index, 0)])
+
+    # Save the mutations that do not fall within an interval to the not matched DataFrame
+    not_matched_df = pd.DataFrame({"chrom": chromosomes[not_matched],
+                                   'position': positions[not_matched],
+                                   'gene': genes[not_matched],
+                                   'type': classifications.to_numpy()[not_matched]})
 
     # Return the intervals with their counts and the DataFrame containing the unmatched mutations
     return intervals_df, not_matched_df
@@ -81,6 +86,10 @@ def prep_mutations(mutations_df):
     # Drop unneeded columns
     mutations_df = mutations_df.drop(['file_path', 'project_id', 'End_Position', 'Strand', 'Variant_Type', 'CCDS'], axis=1)
 
+    # Store the repeated chromosome and classification labels as categories, so comparisons
+    # and grouping work on integer codes instead of strings
+    mutations_df = mutations_df.astype({'Chromosome': 'category', 'Variant_Classification': 'category'})
+
     return mutations_df
 
 
@@ -89,41 +98,47 @@ def main():
     Main Process Flow
     """
 
-    # Import mutation and CCDS split data
+    # Import mutation and CCDS split data, using the Parquet copy of the CCDS split data if it exists
     mutations_df = pd.read_csv("input_data/mutations.csv", sep="\t")
-    regions_df = pd.read_csv("ref_data/modified/CCDS_split.csv")
+    regions_df = load_ref("CCDS_split")
+
+    # Cast the interval boundaries to integers once, so positions are compared as integers
+    regions_df = regions_df.astype({'start': 'int64', 'end': 'int64'})
 
     # Prepare and output the mutation data for counting
     mutations_df = prep_mutations(mutations_df)
 
     mutations_df.to_csv("results/mutations.csv")
 
-    # Initialize the DataFrames that will be output
-    counts_df = regions_df.iloc[:0].copy()
-    counts_df['silent_count'] = 0
-    counts_df['missense_count'] = 0 
-    print(counts_df)
-
-    not_matched_df = pd.DataFrame({"chrom": [], 'position': [], 'gene': [], 'type': []})
+    # Initialize the lists of per chromosome DataFrames that will be output
+    counts_dfs = []
+    not_matched_dfs = []
 
-    # Create a list of chromosomes in the CCDS DataFrame
-    chroms = regions_df['chrom'].unique()
+    # Split the CCDS and mutation DataFrames by chromosome in a single pass each
+    regions_by_chrom = dict(tuple(regions_df.groupby('chrom', sort=False, observed=True)))
+    mutations_by_chrom = dict(tuple(mutations_df.groupby('Chromosome', sort=False, observed=True)))
 
-    for chrom in chroms:
-        # Create temporary Dataframes consisting of only a single chromosme of data
-        tmp_regions_df = regions_df[regions_df['chrom'] == chrom]
-        tmp_mutations_df = mutations_df[mutations_df['Chromosome'] == chrom]
+    for chrom, tmp_regions_df in regions_by_chrom.items():
+        # Get the mutations on the chromosome, or an empty DataFrame if there are none
+        tmp_mutations_df = mutations_by_chrom.get(chrom, mutations_df.iloc[:0])
 
         # Run the split_chrom function to split the rows by SAE and SCE regions
         df1, df2 = add_mutation_counts(tmp_regions_df, tmp_mutations_df)
 
-        # Concatenate regions to the output DataFrames
-        counts_df = pd.concat([counts_df, df1])
-        not_matched_df = pd.concat([not_matched_df, df2])
-    
-    # Return the Dataframes with reset indices
-    counts_df = counts_df.reset_index(drop=True)
-    not_matched_df = not_matched_df.reset_index(drop=True)
+        # Add the regions to the lists of output DataFrames
+        counts_dfs.append(df1)
+        not_matched_dfs.append(df2)
+
+    # Add the mutations on chromosomes without any genomic intervals to the not matched DataFrames
+    tmp_mutations_df = mutations_df[~mutations_df['Chromosome'].isin(list(regions_by_chrom))]
+    not_matched_dfs.append(pd.DataFrame({"chrom": tmp_mutations_df['Chromosome'],
+                                         'position': tmp_mutations_df['Start_Position']-1,
+                                         'gene': tmp_mutations_df['Hugo_Symbol'],
+                                         'type': tmp_mutations_df['Variant_Classification']}))
+
+    # Concatenate the per chromosome DataFrames once with reset indices
+    counts_df = pd.concat(counts_dfs, ignore_index=True)
+    not_matched_df = pd.concat(not_matched_dfs, ignore_index=True)
 
     # Save the results to the results directory
     counts_df.to_csv("results/counts.csv")
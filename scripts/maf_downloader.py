@@ -9,16 +9,35 @@ Note this code was developed with the aid of Claude AI.
 
 import argparse
 import csv
+import gzip
 import json
 import logging
 import os
 import requests
+import shutil
 import sys
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from sh import gunzip
+from requests.adapters import HTTPAdapter
 from typing import List, Dict
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts, in seconds, of the requests to the GDC API
+REQUEST_TIMEOUT = (10, 60)
+
+# Number of attempts to download a file whose transfer is interrupted after the response has started,
+# which is not covered by the retries of the HTTP adapter
+DOWNLOAD_ATTEMPTS = 5
+
+# Errors raised while the response is streamed, from a dropped or stalled connection or a truncated gzip stream
+STREAM_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                 requests.exceptions.ChunkedEncodingError, ProtocolError, ReadTimeoutError,
+                 EOFError, gzip.BadGzipFile, zlib.error)
 
 
 def get_cli_args():
@@ -49,6 +68,13 @@ def get_cli_args():
                         help='Name of log file for MAF downloading',
                         default="MAFdownload.log")
 
+    # Add workers argument to parser
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        help='Number of MAF files downloaded concurrently',
+                        default=8)
+
     return parser.parse_args()
 
 
@@ -56,16 +82,33 @@ class MAFDownloader:
     """
     Class for downloading open access MAF files using the GDC API.
     """
+
+    metadata_fieldnames = [
+        "file_path", "file_id", 
+        "data_type", "data_category", "experimental_strategy",
+        "workflow_type", "project_id", "project_name", "disease_type",
+        "primary_site", "case_id", "case_submitter_id", "download_status"
+    ]
     
-    def __init__(self, output_dir, n_MAFs, logger):
+    def __init__(self, output_dir, n_MAFs, logger, max_workers=8):
         self.base_url = "https://api.gdc.cancer.gov"
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.metadata_file = self.output_dir / "maf_metadata.csv"
         self.metadata = []
+        self.metadata_lock = threading.Lock()
+        self.metadata_fh = None
+        self.metadata_writer = None
         self.n_MAFs = n_MAFs
+        self.max_workers = max_workers
         self.logger = logger
 
+        # Reuse connections to the GDC API and retry failed requests with backoff
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(16, max_workers), max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+
         
     def query_maf_files(self) -> List[Dict]:
         """Query GDC API for all open access MAF files."""
@@ -104,7 +147,7 @@ class MAFDownloader:
         }
         
         self.logger.info("Querying GDC API for MAF files...")
-        response = requests.get(files_endpoint, params=params)
+        response = self.session.get(files_endpoint, params=params, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         
         data = response.json()
@@ -134,7 +177,8 @@ class MAFDownloader:
         # Create cancer type directory
         cancer_dir = self.output_dir / cancer_type
         cancer_dir.mkdir(parents=True, exist_ok=True)
-        output_path = cancer_dir / file_name
+        output_path = cancer_dir / file_name.removesuffix(".gz")
+        partial_path = output_path.with_name(f"{output_path.name}.part")
         
         # Relative path for CSV
         relative_path = f"{cancer_type}/{file_name}"
@@ -149,20 +193,40 @@ class MAFDownloader:
             return True
         
         try:
-            self.logger.info(f"  Downloading {file_name}...")
-            response = requests.get(data_endpoint, stream=True)
-            response.raise_for_status()
-            
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            self.logger.info(f"  ✓ Downloaded {file_name}")
+            self.logger.info(f"  Downloading and decompressing {file_name}...")
 
-            cwd = os.getcwd()
-            self.logger.info(f"  Decompressing {file_name}...")
-            gunzip(f"{cwd}/{output_path}")
-            self.logger.info(f"  ✓ Decompressed {file_name}")
+            # Retry the whole file if the transfer is interrupted, starting again from an empty partial file
+            for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+                try:
+                    with self.session.get(data_endpoint, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                        response.raise_for_status()
+                        response.raw.decode_content = True
+
+                        # Decompress the response as it streams in, so the compressed file never
+                        # touches the disk, and only move it into place once it is complete
+                        with gzip.GzipFile(fileobj=response.raw) as f_in, open(partial_path, 'wb') as f_out:
+                            shutil.copyfileobj(f_in, f_out, length=1 << 20)
+                            f_out.flush()
+
+                            # The file is not read again by this process, so write its pages to disk and
+                            # tell the kernel it does not need to keep them in the page cache, dirty pages
+                            # would otherwise not be dropped (not available or supported on all platforms and
+                            # filesystems, and only advisory, so failing here must not fail the download)
+                            try:
+                                os.fdatasync(f_out.fileno())
+                                os.posix_fadvise(f_out.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                            except (AttributeError, OSError):
+                                pass
+                        os.replace(partial_path, output_path)
+                    break
+                except STREAM_ERRORS as e:
+                    partial_path.unlink(missing_ok=True)
+                    if attempt == DOWNLOAD_ATTEMPTS:
+                        raise
+                    self.logger.warning(f"  Retrying {file_name} (attempt {attempt} of {DOWNLOAD_ATTEMPTS} failed: {str(e)})")
+                    time.sleep(0.5 * 2 ** attempt)
+
+            self.logger.info(f"  ✓ Downloaded and decompressed {file_name}")
 
             # Record metadata
             self._add_metadata(file_info, relative_path, "success")
@@ -199,26 +263,31 @@ class MAFDownloader:
             "download_status": download_status
         }
         
-        self.metadata.append(metadata_entry)
+        # Downloads run in several threads, so guard the shared metadata list and file
+        with self.metadata_lock:
+            self.metadata.append(metadata_entry)
+
+            # Open the metadata file and write the header with the first entry
+            if self.metadata_writer is None:
+                self.metadata_fh = open(self.metadata_file, 'w', newline='', encoding='utf-8')
+                self.metadata_writer = csv.DictWriter(self.metadata_fh, fieldnames=self.metadata_fieldnames)
+                self.metadata_writer.writeheader()
+
+            # Write each entry as soon as it is recorded, so a crash does not lose the metadata
+            self.metadata_writer.writerow(metadata_entry)
+            self.metadata_fh.flush()
     
 
     def save_metadata(self):
-        """Save metadata to CSV file."""
+        """Close the metadata CSV file, which is written as entries are recorded."""
         if not self.metadata:
             self.logger.info(f"No metadata to save")
             return
         
-        fieldnames = [
-            "file_path", "file_id", 
-            "data_type", "data_category", "experimental_strategy",
-            "workflow_type", "project_id", "project_name", "disease_type",
-            "primary_site", "case_id", "case_submitter_id", "download_status"
-        ]
-        
-        with open(self.metadata_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(self.metadata)
+        with self.metadata_lock:
+            self.metadata_fh.close()
+            self.metadata_fh = None
+            self.metadata_writer = None
         
         self.logger.info(f"Metadata saved to: {self.metadata_file.absolute()}")
     
@@ -237,29 +306,16 @@ class MAFDownloader:
         success_count = 0
         fail_count = 0
         
-        for i, file_info in enumerate(files, 1):
-            file_id = file_info["file_id"]
-            file_name = file_info["file_name"]
-            file_size = file_info.get("file_size", 0) / (1024 * 1024)  # Convert to MB
+        # Download several files at once, since each download mostly waits on the network
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._download_with_progress, file_info, i, len(files))
+                       for i, file_info in enumerate(files, 1)]
             
-            # Extract cancer type for display
-            cancer_type = "Unknown"
-            if "cases" in file_info and len(file_info["cases"]) > 0:
-                case = file_info["cases"][0]
-                cancer_type = case.get("disease_type", case.get("primary_site", "Unknown"))
-            
-            self.logger.info(f"[{i}/{len(files)}] {cancer_type}: {file_name} ({file_size:.2f} MB)")
-            
-            attempt = 0
-            while attempt < 5:
-                attempt += 1
-                if self.download_file(file_info):
+            for future in as_completed(futures):
+                if future.result():
                     success_count += 1
-                    time.sleep(0.5)
-                    break
-                if attempt == 5:
+                else:
                     fail_count += 1
-                time.sleep(0.5) 
         
         # Save metadata to CSV
         self.save_metadata()
@@ -272,6 +328,22 @@ class MAFDownloader:
         self.logger.info(f"{'='*60}")
     
 
+    def _download_with_progress(self, file_info: Dict, i: int, n_files: int) -> bool:
+        """Log the progress of and download a single MAF file."""
+        file_name = file_info["file_name"]
+        file_size = file_info.get("file_size", 0) / (1024 * 1024)  # Convert to MB
+        
+        # Extract cancer type for display
+        cancer_type = "Unknown"
+        if "cases" in file_info and len(file_info["cases"]) > 0:
+            case = file_info["cases"][0]
+            cancer_type = case.get("disease_type", case.get("primary_site", "Unknown"))
+        
+        self.logger.info(f"[{i}/{n_files}] {cancer_type}: {file_name} ({file_size:.2f} MB)")
+        
+        return self.download_file(file_info)
+    
+
     def get_file_summary(self) -> Dict:
         """Get summary statistics of available MAF files."""
         files = self.query_maf_files()
@@ -328,6 +400,7 @@ def main():
     args = get_cli_args()
     n = args.number
     logfile = args.logfile
+    workers = args.workers
 
     logging.basicConfig(
         level=logging.INFO,
@@ -341,7 +414,7 @@ def main():
     logger = logging.getLogger(__name__) 
 
     # Create downloader instance
-    downloader = MAFDownloader(output_dir="maf_files", n_MAFs=n, logger=logger)
+    downloader = MAFDownloader(output_dir="maf_files", n_MAFs=n, logger=logger, max_workers=workers)
     
     # First, print summary of available files
     downloader.print_summary()
@@ -7,7 +7,42 @@ MAF files. Creates a single CSV file with a single line per genomic interval
 representing an SAE, SCE or normal exonic region of a human gene.
 """
 
+import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Natural order of the human chromosomes, other contigs are sorted after them
+CHROM_ORDER = [f"chr{i}" for i in range(1, 23)] + ['chrX', 'chrY', 'chrM']
+
+
+def chrom_sort_key(column):
+    """
+    Key function for sort_values that sorts a chrom column in natural chromosome 
+    order (chr1, chr2, ..., chr22, chrX, chrY, chrM) instead of lexicographic order,
+    leaving any other sorted column unchanged.
+
+    Parameters:
+    -----------
+    column: Pandas Series being sorted
+    
+    Returns:
+    --------
+    column: Pandas Series of integer chromosome ranks, or the unchanged column
+    """
+
+    # Leave the columns that are not chromosomes unchanged
+    if column.name != 'chrom':
+        return column
+
+    # Rank the known chromosomes in natural order, followed by the other contigs in 
+    # lexicographic order so that each contig stays contiguous
+    column = column.astype(str)
+    order = CHROM_ORDER + sorted(set(column.unique()) - set(CHROM_ORDER))
+    ranks = {chrom: rank for rank, chrom in enumerate(order)}
+
+    return column.map(ranks)
 
 
 def explode_columns(df, columns, islist=False):
@@ -31,7 +66,7 @@ def explode_columns(df, columns, islist=False):
     # Turn comma separated string into list for each column
     if islist == False:
         for column in columns:
-            df = df.assign(**{column:df[column].str.split(',')})
+            df = df.assign(**{column:df[column].str.split(',', regex=False)})
 
     # Use explode to create a separate row per list entry
     df = df.explode(columns)
@@ -39,6 +74,41 @@ def explode_columns(df, columns, islist=False):
     return df
 
 
+def load_ref(name, directory="ref_data/modified"):
+    """
+    Load a prepared reference file, using its Parquet copy if it exists and is not
+    older than the CSV file so the data types and categories are preserved, and 
+    falling back to the CSV file otherwise.
+
+    Parameters:
+    -----------
+    name: Name of the prepared reference file without extension, e.g. CCDS_split
+    directory: Optional directory containing the prepared reference files
+    
+    Returns:
+    --------
+    df: Pandas DataFrame with the reference data
+    """
+
+    parquet_path = os.path.join(directory, f"{name}.parquet")
+    csv_path = os.path.join(directory, f"{name}.csv")
+
+    # The Parquet copy is stale if the CSV file was written or extracted after it, unzip keeps the
+    # archived modification time, so the change time of the CSV file is also checked
+    use_parquet = os.path.exists(parquet_path)
+    if use_parquet and os.path.exists(csv_path):
+        csv_stat = os.stat(csv_path)
+        use_parquet = os.path.getmtime(parquet_path) >= max(csv_stat.st_mtime, csv_stat.st_ctime)
+
+    # Read the Parquet copy if it is up to date, otherwise read the CSV file
+    if use_parquet:
+        df = pd.read_parquet(parquet_path, engine="pyarrow")
+    else:
+        df = pd.read_csv(csv_path)
+
+    return df
+
+
 def SAE_SCE_prep(path):
     """
     Prepares SAE and SCE files for combination with the CCDS dataset.
@@ -56,29 +126,27 @@ def SAE_SCE_prep(path):
     # Load SAE or SCE csv file into dataframe
     df = pd.read_csv(path)
 
-    # Define columns to be exploded
-    columns = ["blockSizes", "chromStarts"]
-
-    # Explode Columns
-    df = explode_columns(df, columns)
+    # Split the comma separated block sizes and starts, and flatten them into integer arrays
+    block_sizes = df['blockSizes'].str.split(',', regex=False)
+    block_starts = df['chromStarts'].str.split(',', regex=False)
+    block_counts = block_sizes.str.len().to_numpy()
+    block_sizes = np.concatenate(block_sizes.to_numpy()).astype(np.int64)
+    block_starts = np.concatenate(block_starts.to_numpy()).astype(np.int64)
 
-    # Cast blocksize and chromstart columns to integer type
-    df['blockSize'] = df['blockSizes'].astype(int)
-    df['chromStarts'] = df['chromStarts'].astype(int)
+    # Repeat each row once per block, creating a separate row per block
+    df = df.loc[df.index.repeat(block_counts)]
 
     # Drop unneeded columns
-    df.drop(['score', 'thickStart', 'thickEnd', 'reserved', 'blockCount', 'blockSizes'], axis=1, inplace=True)
+    df = df.drop(['score', 'thickStart', 'thickEnd', 'reserved', 'blockCount', 'blockSizes', 'chromStarts'], axis=1)
 
-    # Calculate chromstart and chromend for exploded colunms
-    df['chromStart'] = df['chromStart'] + df['chromStarts']
+    # Calculate chromstart and chromend for each block
+    df['blockSize'] = block_sizes
+    df['chromStart'] = df['chromStart'].to_numpy() + block_starts
     # Adjust chromend value to be 0-based, see https://genome.ucsc.edu/FAQ/FAQtracks
     # for details (start is 0-based, end is 1-based by default)
     df['chromEnd'] = df['chromStart'] + df['blockSize'] - 1
 
-    # Drop unneeded columns
-    df.drop(['chromStarts'], axis=1, inplace=True)
-
-    df = df.sort_values(by=['chrom', 'chromStart'])
+    df = df.sort_values(by=['chrom', 'chromStart'], key=chrom_sort_key)
 
     return df
 
@@ -96,16 +164,17 @@ def CCDS_prep(path):
     df: Pandas DataFrame with relevant SAE or SCE data
     """
 
-    # Load CCDS input file into dataframe
-    df = pd.read_csv("ref_data/raw/CCDS.current.txt", sep="\t")
+    # Load CCDS input file into dataframe, skipping the unneeded cds_from and cds_to columns
+    df = pd.read_csv(path, sep="\t",
+                     usecols=['#chromosome', 'nc_accession', 'gene', 'gene_id', 'ccds_id', 'ccds_status', 'cds_strand', 'cds_locations', 'match_type'],
+                     dtype={'#chromosome': str, 'ccds_status': 'category', 'match_type': 'category'})
 
     # Filter out CCDS data that has been withdrawn or is not complete 
     df = df.loc[df['ccds_status'].isin(['Public', 'Under review, update', 'Under review, withdrawal'])]
     df = df[df['match_type'] != 'Partial']
 
     # Prepare locations column for explosion
-    df["cds_locations"] = df["cds_locations"].str.replace("[", "")
-    df["cds_locations"] = df["cds_locations"].str.replace("]", "")
+    df["cds_locations"] = df["cds_locations"].str.strip("[]")
 
     # Define columns to be exploded
     columns = ["cds_locations"]
@@ -116,22 +185,30 @@ def CCDS_prep(path):
     # Create start and end columns based on the locations column
     df[["cds_start", "cds_end"]] = df["cds_locations"].str.split('-', n=1, expand=True)
 
-    # Create chromosome column in chr# format
-    df.insert(0, "chrom", "chr" + df["#chromosome"])
+    # Create chromosome column in chr# format, adding the prefix in one vectorized call and storing
+    # the few distinct chromosomes as a category
+    df.insert(0, "chrom", pd.Categorical(np.char.add('chr', df["#chromosome"].to_numpy(dtype=str))))
 
     # Drop unneeded columns
-    df.drop(['#chromosome', 'cds_from', 'cds_to', 'match_type', 'ccds_status', 'cds_locations'], axis=1, inplace=True)
+    df.drop(['#chromosome', 'match_type', 'ccds_status', 'cds_locations'], axis=1, inplace=True)
 
     # Cast start and end columns to integer type
     df['cds_start'] = df['cds_start'].str.strip().astype('int')
     df['cds_end'] = df['cds_end'].str.strip().astype('int')
 
-    # Merge rows with exact same chromosome, start and end 
-    df = df.groupby(['chrom','nc_accession','gene','gene_id','cds_strand','cds_start','cds_end'], as_index=False).agg({'ccds_id':','.join}).reset_index(drop=True)
-    df['ccds_id'] = df['ccds_id'].apply(lambda x: f"[{x}]")
+    # Merge rows with exact same chromosome, start and end by sorting on the keys and joining
+    # the ccds_id of each run of equal keys, instead of hashing the composite key
+    keys = ['chrom','nc_accession','gene','gene_id','cds_strand','cds_start','cds_end']
+    df = df.sort_values(by=keys, kind='stable').reset_index(drop=True)
+    keys_arr = df[keys].to_numpy()
+    run_starts = np.r_[0, np.flatnonzero((keys_arr[1:] != keys_arr[:-1]).any(axis=1)) + 1]
+    run_ends = np.r_[run_starts[1:], len(df)]
+    ids = df['ccds_id'].tolist()
+    joined = [f"[{','.join(ids[start:end])}]" for start, end in zip(run_starts, run_ends)]
+    df = df.drop(columns='ccds_id').iloc[run_starts].assign(ccds_id=joined).reset_index(drop=True)
 
-    # Sort by chromosome, start and end
-    df = df.sort_values(by=['chrom', 'cds_start', 'cds_end'], ascending=[True, True, True]).reset_index(drop=True)
+    # Sort by chromosome in natural order, start and end
+    df = df.sort_values(by=['chrom', 'cds_start', 'cds_end'], ascending=[True, True, True], key=chrom_sort_key).reset_index(drop=True)
 
     # Merge rows with overalapping intervals 
     df = merge_overlapping(df, 'chrom', 'cds_start', 'cds_end')
@@ -159,61 +236,31 @@ def merge_overlapping(df, chrom_label, start_label, end_label):
     df: Pandas DataFrame with merged overlapping intervals 
     """
 
-    # Define variables
-    start = 0
-    end = 0
-    chrom = "chr0"
-    keep_list = []
- 
-    for index, row in df.iterrows():
-        #Check for when the chromosome changes to the next one
-        if row[chrom_label] > chrom:
-            # append to the keep list and reset variables
-            keep_list.append([index-1, chrom, start, end])
-            start = 0
-            end = 0
-            chrom = row[chrom_label]
-
-        # Check if the start label is smaller than the current end    
-        if row[start_label] <= end:
-            # Check if the end label is larger than the current end
-            if row[end_label] > end:
-                # If True, update the end variable
-                end = row[end_label]
-        # Otherwise, append and reset the start and end variables
-        else:
-            keep_list.append([index-1, row[chrom_label], start, end])
-            start = row[start_label]
-            end = row[end_label]
-
-    # Remove the first element of the keep list, since it contains all zeros
-    keep_list.pop(0)
-
-    # Append the final entry to the keep list
-    keep_list.append([index, chrom, start, end])
-
-    # Remove the first element from every chromosome, similar to previously
-    real_keep_list = []
-    for entry in keep_list:
-        if entry[2] != 0:
-            real_keep_list.append(entry)
-
-    # Use zip and list comprehension to create individual lists for the index, 
-    # chromosome, start and end
-    unzipped_columns = zip(*real_keep_list)
-    index, chrom, start, end = [list(col) for col in unzipped_columns]
-
-    # Keep only the indices that were found previously
-    df = df.iloc[index]
-
-    # Reset start and end columns in the df DataFrame
-    df[start_label] = start
-    df[end_label] = end
+    # Extract the chromosome and interval columns as NumPy arrays
+    chroms = df[chrom_label].to_numpy()
+    starts = df[start_label].to_numpy()
+
+    # Calculate the furthest end reached so far within each chromosome
+    furthest_ends = df.groupby(chrom_label, sort=False, observed=True)[end_label].cummax().to_numpy()
+
+    # A row starts a new merged interval if it is the first row of a chromosome or if it starts
+    # after the furthest end of the previous rows
+    new_interval = np.ones(len(df), dtype=bool)
+    new_interval[1:] = (chroms[1:] != chroms[:-1]) | (starts[1:] > furthest_ends[:-1])
+
+    # The last row of each merged interval is the one right before the next merged interval
+    last_row = np.append(new_interval[1:], True)
+
+    # Keep the last row of each merged interval, with the start of its first row and the 
+    # furthest end reached
+    df = df.iloc[np.flatnonzero(last_row)].copy()
+    df[start_label] = starts[new_interval]
+    df[end_label] = furthest_ends[last_row]
 
     return df
 
 
-def split_CCDS_by_coverage(CCDS_df, SAE_SCE_df):
+def split_CCDS_by_coverage(CCDS_df, SAE_SCE_df, max_workers=None):
     """
     Function for feeding chromosome restricted CCDS Dataframes and SAE_SCE DataFrames to 
     a function that splits the CCDS rows if they are SAE or SCE regions.
@@ -222,6 +269,8 @@ def split_CCDS_by_coverage(CCDS_df, SAE_SCE_df):
     -----------
     CCDS_df: Pandas DataFrame with sorted CCDS information
     SAE_SCE_df : Pandas DataFrame with sorted SAE and SCE information
+    max_workers: Optional maximum number of processes splitting chromosomes in parallel,
+        defaults to the number of CPUs
     
     Returns:
     --------
@@ -229,28 +278,36 @@ def split_CCDS_by_coverage(CCDS_df, SAE_SCE_df):
     del_df = Pandas DataFrame with SAE and SCE regions that did not fit in any CCDS rows
     """
 
-    # Initialize the DataFrames that will be output
-    keep_df = pd.DataFrame({"chrom": [], 'start': [], 'end': [], 'gene': [], 'type': []})
-    del_df = pd.DataFrame({"chrom": [], 'start': [], 'end': [], 'gene': [], 'type': []})
-
-    # Create a list of chromosomes in the CCDS DataFrame
-    chroms = CCDS_df['chrom'].unique()
-
-    for chrom in chroms:
-        # Create temporary Dataframes consisting of only a single chromosme of data
-        tmp_CCDS_df = CCDS_df[CCDS_df['chrom'] == chrom]
-        tmp_SAE_SCE_df = SAE_SCE_df[SAE_SCE_df['chrom'] == chrom]
+    # Encode the region types as small integer category codes, adding the normal type that is
+    # given to the CCDS regions outside of any SAE or SCE region
+    SAE_SCE_df = SAE_SCE_df.assign(type=pd.Categorical(SAE_SCE_df['type'], categories=[*sorted(SAE_SCE_df['type'].unique()), 'normal']))
 
-        # Run the split_chrom function to split the rows by SAE and SCE regions
-        df1, df2 = _split_chrom(tmp_CCDS_df, tmp_SAE_SCE_df)
+    # Split the CCDS and SAE SCE DataFrames by chromosome in a single pass each
+    CCDS_by_chrom = dict(tuple(CCDS_df.groupby('chrom', sort=False, observed=True)))
+    SAE_SCE_by_chrom = dict(tuple(SAE_SCE_df.groupby('chrom', sort=False)))
 
-        # Concatenate regions to the output DataFrames
-        keep_df = pd.concat([keep_df, df1])
-        del_df = pd.concat([del_df, df2])
+    # Create a list of chromosomes in the CCDS DataFrame
+    chroms = list(CCDS_by_chrom)
+
+    # Run the split_chrom function on each chromosome in parallel, since the chromosomes are
+    # independent of each other, keeping the results in chromosome order
+    max_workers = min(len(chroms), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_split_chrom,
+                                    [CCDS_by_chrom[chrom] for chrom in chroms],
+                                    [SAE_SCE_by_chrom.get(chrom, SAE_SCE_df.iloc[:0]) for chrom in chroms]))
+
+    # Separate the kept and deleted regions of each chromosome
+    keep_dfs = [df1 for df1, df2 in results]
+    del_dfs = [df2 for df1, df2 in results]
     
-    # Return the Dataframes with reset indices
-    keep_df = keep_df.reset_index(drop=True)
-    del_df = del_df.reset_index(drop=True)
+    # Concatenate the per chromosome DataFrames once with reset indices
+    keep_df = pd.concat(keep_dfs, ignore_index=True)
+    del_df = pd.concat(del_dfs, ignore_index=True)
+
+    # Store the repeated chromosome labels as categories
+    keep_df['chrom'] = keep_df['chrom'].astype('category')
+    del_df['chrom'] = del_df['chrom'].astype('category')
     
     return keep_df, del_df
 
@@ -262,70 +319,95 @@ def _split_chrom(CCDS_df, SAE_SCE_df):
     Parameters:
     -----------
     CCDS_df: Pandas DataFrame with sorted CCDS information
-    SAE_SCE_df : Pandas DataFrame with sorted SAE and SCE information
+    SAE_SCE_df : Pandas DataFrame with sorted SAE and SCE information, with the type as a 
+        categorical that includes the normal type
     
     Returns:
     --------
     df = Pandas DataFrame with split CCDS rows by SAE and SCE
     """
 
-    # Duplicate the last row of the DataFrame
-    last_row = SAE_SCE_df.iloc[[-1]]
-    SAE_SCE_df = pd.concat([SAE_SCE_df, last_row])
+    # Extract the SAE and SCE columns as lists, so the loop below works on plain Python values,
+    # with the types as their integer category codes
+    SAE_SCE_starts = SAE_SCE_df['chromStart'].tolist()
+    SAE_SCE_ends = SAE_SCE_df['chromEnd'].tolist()
+    SAE_SCE_types = SAE_SCE_df['type'].cat.codes.tolist()
 
-    # Define metadata for output DataFrames
-    keep_df = pd.DataFrame({"chrom": [], 'start': [], 'end': [], 'gene': [], 'type': []})
-    del_df = pd.DataFrame({"chrom": [], 'start': [], 'end': [], 'gene': [], 'type': []})
+    # Get the type categories and the code of the normal type
+    categories = SAE_SCE_df['type'].cat.categories
+    normal = categories.get_loc('normal')
+
+    # Duplicate the last SAE or SCE region, if the chromosome has none every CCDS row is kept
+    # as a single normal region by the loop below
+    if SAE_SCE_starts:
+        SAE_SCE_starts.append(SAE_SCE_starts[-1])
+        SAE_SCE_ends.append(SAE_SCE_ends[-1])
+        SAE_SCE_types.append(SAE_SCE_types[-1])
+
+    # Initialize the lists of rows for the output DataFrames
+    keep_rows = []
+    del_rows = []
 
     # Initialize index for iteration
     SAE_SCE_index = 0
 
-    # Calculate the length of the SAE/SCE DataFrame
-    SAE_SCE_len = len(SAE_SCE_df)
+    # Calculate the number of SAE/SCE regions
+    SAE_SCE_len = len(SAE_SCE_starts)
 
-    for index, row in CCDS_df.iterrows():
+    for chrom, cds_start, cds_end, gene in CCDS_df[['chrom', 'cds_start', 'cds_end', 'gene']].itertuples(index=False, name=None):
 
-        CCDS_start = row['cds_start']
+        CCDS_start = cds_start
 
         # Iterate if the SAE or SCE region starts before the CCDS region end and ensure that the 
         # index is not out of bounds
-        while SAE_SCE_index < SAE_SCE_len and SAE_SCE_df.iloc[SAE_SCE_index]['chromStart'] <= row['cds_end']:
+        while SAE_SCE_index < SAE_SCE_len and SAE_SCE_starts[SAE_SCE_index] <= cds_end:
+
+            # Get the current SAE or SCE region
+            region_start = SAE_SCE_starts[SAE_SCE_index]
+            region_end = SAE_SCE_ends[SAE_SCE_index]
+            region_type = SAE_SCE_types[SAE_SCE_index]
 
             # If the CCDS region starts after the current SAE SCE region, save the SAE SCE information
             # to the deleted DataFrame and reset the CCDS_start variable
-            if CCDS_start > SAE_SCE_df.iloc[SAE_SCE_index]['chromStart']:
-                del_df.loc[len(del_df)] = [row['chrom'], SAE_SCE_df.iloc[SAE_SCE_index]['chromStart'], CCDS_start-1, row['gene'], SAE_SCE_df.iloc[SAE_SCE_index]['type']]
-                CCDS_start = SAE_SCE_df.iloc[SAE_SCE_index]['chromStart']
+            if CCDS_start > region_start:
+                del_rows.append((chrom, region_start, CCDS_start-1, gene, region_type))
+                CCDS_start = region_start
 
             # Otherwise, if the CCDS region start is not equal to the SAE SCE region start, add a line to the keep
             # DataFrame with normal type     
-            elif CCDS_start != SAE_SCE_df.iloc[SAE_SCE_index]['chromStart']:
-                keep_df.loc[len(keep_df)] = [row['chrom'], CCDS_start, SAE_SCE_df.iloc[SAE_SCE_index]['chromStart']-1, row['gene'], 'normal']
+            elif CCDS_start != region_start:
+                keep_rows.append((chrom, CCDS_start, region_start-1, gene, normal))
             
             # If the SAE SCE region ends before th CCDS region end, add a line to the keep DataFrame
             # and update the CCDS_start to the position after the end of the region that was just added
-            if SAE_SCE_df.iloc[SAE_SCE_index]['chromEnd'] <= row['cds_end']:
-                keep_df.loc[len(keep_df)] = [row['chrom'], SAE_SCE_df.iloc[SAE_SCE_index]['chromStart'], SAE_SCE_df.iloc[SAE_SCE_index]['chromEnd'], row['gene'], SAE_SCE_df.iloc[SAE_SCE_index]['type']]
-                CCDS_start = SAE_SCE_df.iloc[SAE_SCE_index]['chromEnd'] + 1
+            if region_end <= cds_end:
+                keep_rows.append((chrom, region_start, region_end, gene, region_type))
+                CCDS_start = region_end + 1
             
             # Otherwise, add a line to the keep DataFrame for the region until the CCDS end and add 
             # a line to the delete DataFrame with the rest of the interval
             else: 
-                keep_df.loc[len(keep_df)] = [row['chrom'], SAE_SCE_df.iloc[SAE_SCE_index]['chromStart'], row['cds_end'], row['gene'], SAE_SCE_df.iloc[SAE_SCE_index]['type']]
-                del_df.loc[len(del_df)] = [row['chrom'], row['cds_end']+1, SAE_SCE_df.iloc[SAE_SCE_index]['chromEnd'], row['gene'], SAE_SCE_df.iloc[SAE_SCE_index]['type']]
+                keep_rows.append((chrom, region_start, cds_end, gene, region_type))
+                del_rows.append((chrom, cds_end+1, region_end, gene, region_type))
 
             # If the index is 1 from the end, add a normal region making up the rest of the CCDS interval
             if SAE_SCE_index == SAE_SCE_len - 2:
-                keep_df.loc[len(keep_df)] = [row['chrom'], SAE_SCE_df.iloc[SAE_SCE_index]['chromEnd']+1, row['cds_end'], row['gene'], 'normal']
+                keep_rows.append((chrom, region_end+1, cds_end, gene, normal))
 
-            # Iterate the SAE SCE index and pull the relevant DataFrame row
+            # Iterate the SAE SCE index to get the next region
             SAE_SCE_index += 1
             
 
         # If the algorithm did not enter the previous while loop, add the entire CCDS intveral as a 
         # normal region to the keep DataFrame
-        if CCDS_start <= row['cds_end']:
-            keep_df.loc[len(keep_df)] = [row['chrom'], CCDS_start, row['cds_end'], row['gene'], 'normal']
+        if CCDS_start <= cds_end:
+            keep_rows.append((chrom, CCDS_start, cds_end, gene, normal))
+
+    # Create the output DataFrames from the rows, mapping the type codes back to their categories
+    keep_df = pd.DataFrame(keep_rows, columns=['chrom', 'start', 'end', 'gene', 'type'])
+    del_df = pd.DataFrame(del_rows, columns=['chrom', 'start', 'end', 'gene', 'type'])
+    keep_df['type'] = pd.Categorical.from_codes(keep_df['type'].to_numpy(np.int8), categories)
+    del_df['type'] = pd.Categorical.from_codes(del_df['type'].to_numpy(np.int8), categories)
             
     return keep_df, del_df
 
@@ -347,9 +429,9 @@ def SAE_SCE_merge(SAE_df, SCE_df):
     SAE_df['type'] = 'SAE'
     SCE_df['type'] = 'SCE'
 
-    # Sort Dataframes by chromosome and genomic position
-    SAE_df = SAE_df.sort_values(by=['chrom', 'chromStart', 'chromEnd'], ascending=[True, True, True]).reset_index(drop=True)
-    SCE_df = SCE_df.sort_values(by=['chrom', 'chromStart', 'chromEnd'], ascending=[True, True, True]).reset_index(drop=True)
+    # Sort Dataframes by chromosome in natural order and genomic position
+    SAE_df = SAE_df.sort_values(by=['chrom', 'chromStart', 'chromEnd'], ascending=[True, True, True], key=chrom_sort_key).reset_index(drop=True)
+    SCE_df = SCE_df.sort_values(by=['chrom', 'chromStart', 'chromEnd'], ascending=[True, True, True], key=chrom_sort_key).reset_index(drop=True)
 
     # Merge the overlapping regions
     SAE_df = merge_overlapping(SAE_df, 'chrom', 'chromStart', 'chromEnd')
@@ -357,7 +439,7 @@ def SAE_SCE_merge(SAE_df, SCE_df):
 
     # Concatenate and resort the produced dataframe by chromosome and genomic location
     df = pd.concat([SAE_df, SCE_df])
-    df = df.sort_values(by=['chrom', 'chromStart', 'chromEnd'], ascending=[True, True, True]).reset_index(drop=True)
+    df = df.sort_values(by=['chrom', 'chromStart', 'chromEnd'], ascending=[True, True, True], key=chrom_sort_key).reset_index(drop=True)
 
     return df
 
@@ -378,13 +460,17 @@ def main():
     # Create the intervals data with genomic regions split by CCDS, SAE and SCE
     CCDS_split_df, CCDS_del_df = split_CCDS_by_coverage(CCDS_df, SAE_SCE_df)
 
-    # Save the results
-    SAE_df.to_csv("ref_data/modified/SAE.csv", index=False)
-    SCE_df.to_csv("ref_data/modified/SCE.csv", index=False)
-    SAE_SCE_df.to_csv("ref_data/modified/SAE_SCE.csv", index=False)
-    CCDS_df.to_csv("ref_data/modified/CCDS.csv", index=False)
-    CCDS_split_df.to_csv("ref_data/modified/CCDS_split.csv", index=False)
-    CCDS_del_df.to_csv("ref_data/modified/CCDS_del.csv", index=False)
+    # Save the results as CSV files, and as Parquet copies that keep the data types
+    results = {"SAE": SAE_df,
+               "SCE": SCE_df,
+               "SAE_SCE": SAE_SCE_df,
+               "CCDS": CCDS_df,
+               "CCDS_split": CCDS_split_df,
+               "CCDS_del": CCDS_del_df}
+
+    for name, df in results.items():
+        df.to_csv(f"ref_data/modified/{name}.csv", index=False)
+        df.to_parquet(f"ref_data/modified/{name}.parquet", index=False, compression="zstd")
 
 
 if __name__ == "__main__":
@@ -5,56 +5,114 @@ Created: 15-Nov-2025 by Paulo Miguel
 Validate mutations from MAF files and output them into a single CSV file.
 """
 
+import numpy as np
 import pandas as pd
 import logging
+import atexit
 import sys
 import csv
 import os
+import shutil
+import tempfile
 from genome_kit import Genome
 from genome_kit import Interval
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from collections import OrderedDict
+from logging.handlers import MemoryHandler
 from datetime import datetime
 
 
-def import_maf(path):
+# Relevant columns of the MAF files
+MAF_COLUMNS = ['Hugo_Symbol',
+               'Entrez_Gene_Id',
+               'NCBI_Build',
+               'Chromosome',
+               'Start_Position',
+               'End_Position',
+               'Strand',
+               'Variant_Classification',
+               'Variant_Type',
+               'Reference_Allele',
+               'Tumor_Seq_Allele1',
+               'Tumor_Seq_Allele2',
+               'Mutation_Status',
+               'Gene',
+               'Feature',
+               'cDNA_position',
+               'CDS_position',
+               'Protein_position',
+               'Amino_acids',
+               'Codons',
+               'CCDS']
+
+# Data types of the MAF columns with few distinct values or integer positions
+MAF_DTYPES = {'Chromosome': 'category',
+              'Strand': 'category',
+              'Variant_Classification': 'category',
+              'Variant_Type': 'category',
+              'Start_Position': 'int32',
+              'End_Position': 'int32'}
+
+# Separator line between the log messages of each file
+SEP = "=" * 60
+
+# Maximum number of MAF rows processed at a time
+MAF_CHUNKSIZE = 200_000
+
+# Translation table of the complementary nucleotides, used to read the reference nucleotides 
+# of the minus strand
+COMPLEMENT = bytes.maketrans(b'ACGTNacgtn', b'TGCANtgcan')
+
+# Lookup table from the ASCII code of a nucleotide to the ASCII code of its complement
+COMPLEMENT_CODES = np.frombuffer(COMPLEMENT, dtype=np.uint8)
+
+# Size in bases of the genomic windows fetched in a single genome lookup
+WINDOW_SIZE = 1_000_000
+
+# Genome kit Genome object of a worker process, loaded once by _init_worker
+_genome = None
+
+# Maximum number of fetched genomic windows kept in memory by each process
+WINDOW_CACHE_SIZE = 64
+
+# Most recently fetched genomic windows, keyed by chromosome and window number, with the 
+# start and sequence of each window
+_window_cache = OrderedDict()
+
+# Header of the output mutations CSV file
+MUTATIONS_HEADER = ['file_path', 'project_id', 'project_name', 'disease_type', 'primary_site',
+                    'Hugo_Symbol', 'Entrez_Gene_Id', 'Chromosome', 'Start_Position', 'End_Position',
+                    'Strand', 'Variant_Classification', 'Variant_Type', 'CCDS']
+
+# Metadata columns of the MAF files that are added to the output mutations
+METADATA_COLUMNS = MUTATIONS_HEADER[:5]
+
+# Header of the output raw counts CSV file
+COUNTS_HEADER = ['file_path', 'saved_mutations', 'total_mutations']
+
+
+def import_maf_chunks(path, chunksize=MAF_CHUNKSIZE):
     """
-    Import MAF file
+    Import MAF file in chunks of rows, so that the memory used does not depend on the
+    size of the file
     
     Parameters:
     -----------
     path: Path to the MAF file to import
+    chunksize: Optional maximum number of rows of each chunk
     
-    Returns:
-    --------
-    df: Pandas Dataframe containing MAF file information
+    Yields:
+    -------
+    df: Pandas Dataframe containing a chunk of the MAF file information
     """
 
-    # Read the MAF file, ignoring the first 7 rows
-    df = pd.read_csv(path, sep='\t', header=7)
-
-    # Keep only relevant columns
-    df = df[['Hugo_Symbol',
-            'Entrez_Gene_Id',
-            'NCBI_Build',
-            'Chromosome',
-            'Start_Position',
-            'End_Position',
-            'Strand',
-            'Variant_Classification',
-            'Variant_Type',
-            'Reference_Allele',
-            'Tumor_Seq_Allele1',
-            'Tumor_Seq_Allele2',
-            'Mutation_Status',
-            'Gene',
-            'Feature',
-            'cDNA_position',
-            'CDS_position',
-            'Protein_position',
-            'Amino_acids',
-            'Codons',
-            'CCDS']]
-    
-    return df
+    # Read the MAF file, ignoring the first 7 rows and keeping only relevant columns
+    with pd.read_csv(path, sep='\t', header=7, usecols=MAF_COLUMNS, dtype=MAF_DTYPES, engine='c', chunksize=chunksize) as reader:
+        for df in reader:
+
+            # Restore the column order of the relevant columns
+            yield df[MAF_COLUMNS]
 
 
 def import_metadata(path):
@@ -67,18 +125,12 @@ def import_metadata(path):
     
     Returns:
     --------
-    metadata: list containing MAF metadata
+    metadata: Pandas DataFrame containing MAF metadata
     """
 
-    # Try opening metadata
+    # Try reading metadata, keeping every field as a string and empty fields as empty strings
     try:
-        with open(path, 'r') as file:
-
-            # Create list of metadata data
-            csv_reader = csv.reader(file)
-            metadata = list(csv_reader)
-            # Remove the header
-            metadata.pop(0)
+        metadata = pd.read_csv(path, dtype=str, keep_default_na=False)
 
         return metadata
     
@@ -87,28 +139,186 @@ def import_metadata(path):
         print(f"Error: {path} not found. Please ensure the file exists.")
 
 
-def check_nucleotide(genome, chrom, pos, strand, ref_allele):
+def _fetch_window(genome, chrom, window, start, end):
     """
-    Check if a nucleotide matches the reference nucleotide for a give genomic position
+    Fetch the plus strand sequence of a genomic window covering the start and end positions,
+    reusing the cached sequence of the window when it already covers them, so that recurrent
+    mutation hotspots across chunks and files do not fetch the same sequence again
     
     Parameters:
     -----------
     genome: genome kit Genome object for the genome in question
-    chrom: Chromosome
-    pos: Location of the nucleotide within the chromosome to be checked
-    strand: The direction of the genome the nucleotide came from
-    ref_allele: The nucleotide that is being checked
+    chrom: Chromosome of the window
+    window: Number of the window on the chromosome
+    start: 0-based start position that must be covered
+    end: 0-based end position (exclusive) that must be covered
     
     Returns:
     --------
-    Boolean: True if there is a match, False if it does not match
+    window_start: 0-based start position of the fetched sequence
+    sequence: NumPy array with the ASCII codes of the plus strand sequence
     """
 
-    # Find the nucleotide at the genomic location
-    interval = Interval(chrom, strand, pos-1, pos, 'hg38')
+    key = (chrom, window)
+    cached = _window_cache.get(key)
+
+    if cached is not None:
+        cached_start, cached_sequence = cached
+        cached_end = cached_start + len(cached_sequence)
+
+        # Reuse the cached sequence if it covers the positions
+        if cached_start <= start and end <= cached_end:
+            _window_cache.move_to_end(key)
+            return cached
+
+        # Otherwise extend the positions to also cover the cached sequence
+        start = min(start, cached_start)
+        end = max(end, cached_end)
+
+    # Fetch the sequence and cache it, removing the least recently used window if the cache is full
+    cached = (start, np.frombuffer(genome.dna(Interval(chrom, '+', start, end, 'hg38')).encode('ascii'), dtype=np.uint8))
+    _window_cache[key] = cached
+    _window_cache.move_to_end(key)
+    if len(_window_cache) > WINDOW_CACHE_SIZE:
+        _window_cache.popitem(last=False)
+
+    return cached
+
+
+def check_nucleotides(genome, mutations_df, window_size=WINDOW_SIZE):
+    """
+    Check if the nucleotides of a batch of mutations match the reference nucleotides 
+    for their genomic positions, fetching the reference sequence once per genomic window
+    instead of once per mutation
+    
+    Parameters:
+    -----------
+    genome: genome kit Genome object for the genome in question
+    mutations_df: Pandas DataFrame with the Chromosome, Start_Position, Strand and 
+        Reference_Allele of the mutations to be checked
+    window_size: Optional size in bases of the genomic windows fetched in a single lookup
+    
+    Returns:
+    --------
+    matches: Pandas Series of booleans, True if there is a match, False if it does not match
+    """
+
+    # Convert the positions to 0-based positions and assign each mutation to a genomic window
+    positions = mutations_df['Start_Position'].to_numpy(dtype='int64') - 1
+    windows = positions // window_size
+
+    # Initialize the array of ASCII codes of the reference nucleotides
+    nucleotides = np.empty(len(mutations_df), dtype=np.uint8)
+
+    # Fetch the plus strand sequence spanning the mutations of each chromosome window once, or 
+    # reuse it from the cache, and read the nucleotides of the mutations from it in one step
+    groups = mutations_df.groupby([mutations_df['Chromosome'], windows], sort=False, observed=True).indices
+    for (chrom, window), rows in groups.items():
+        start, sequence = _fetch_window(genome, chrom, int(window), int(positions[rows].min()), int(positions[rows].max()) + 1)
+        nucleotides[rows] = sequence[positions[rows] - start]
+
+    # Complement the nucleotides of the mutations on the minus strand
+    minus = mutations_df['Strand'].eq('-').to_numpy()
+    nucleotides[minus] = COMPLEMENT_CODES[nucleotides[minus]]
+
+    # Encode the single nucleotide reference alleles as ASCII codes, any other allele does not match
+    alleles = mutations_df['Reference_Allele'].astype(str)
+    single = alleles.str.len().eq(1).to_numpy()
+    allele_codes = np.zeros(len(mutations_df), dtype=np.uint8)
+    allele_codes[single] = alleles[single].to_numpy(dtype='S1').view(np.uint8)
 
     # Return True or False based on if the nucletides match
-    return genome.dna(interval) == ref_allele
+    return pd.Series((nucleotides == allele_codes) & single, index=mutations_df.index)
+
+
+def _init_worker(genome_name):
+    """
+    Initialize a worker process by loading its genome kit Genome object once
+
+    Parameters:
+    -----------
+    genome_name: Name of the genome to load, e.g. hg38
+    """
+
+    global _genome
+    _genome = Genome(genome_name)
+
+
+def process_maf(line, part_dir, keep_mismatches=False):
+    """
+    Validate the mutations of a single MAF file against the genome of the worker process
+    
+    Parameters:
+    -----------
+    line: Dictionary with the metadata of the MAF file, keyed by the metadata column names
+    part_dir: Temporary directory, owned by the main process, where the saved mutations are written
+    keep_mismatches: Optional parameter that indicates whether the index and reference allele of
+        each mismatched SNP are returned, so that the main process can log them at debug level
+    
+    Returns:
+    --------
+    part_path: Path to a temporary file with the UTF-8 encoded, tab separated rows of the saved 
+        mutations, to be appended to the mutations file and removed by the caller
+    rejected: Pandas Series with the number of rejected mutations of each classification and type
+    mismatched: Number of SNPs whose reference allele does not match the genome
+    mismatches: List of (index, reference allele) tuples of the mismatched SNPs, empty unless
+        keep_mismatches is set
+    file_saved_mutations: Number of saved mutations of the file
+    file_total_mutations: Number of mutations of the file
+    """
+
+    # Initialize the counts accumulated across the chunks of the file
+    rejected_counts = []
+    mismatched = 0
+    mismatches = []
+    file_saved_mutations = 0
+    file_total_mutations = 0
+
+    # Create the temporary file that the saved mutations are streamed to chunk by chunk, so that 
+    # neither the worker nor the main process holds all of the file's rows in memory
+    fd, part_path = tempfile.mkstemp(suffix=".part", dir=part_dir)
+
+    try:
+        with open(fd, "wb", buffering=1<<20) as fh_part:
+
+            # Import and validate the MAF file one chunk at a time
+            for sample_df in import_maf_chunks(f"maf_files/{line['file_path']}"):
+
+                # Keep only the missense and silent SNPs, which are the only mutations that are checked,
+                # the rest of the file's mutations are rejected up front
+                is_snp = sample_df['Variant_Classification'].isin(['Missense_Mutation', 'Silent']) & (sample_df['Variant_Type'] == 'SNP')
+                snps_df = sample_df[is_snp]
+
+                # Check the reference nucleotides of all the SNPs in a single batch
+                matches = check_nucleotides(_genome, snps_df)
+
+                # Keep the SNPs whose allele nucleotide does not match the reference nucleotide for the main
+                # process to log, only selecting them when it logs at debug level
+                if keep_mismatches:
+                    mismatched_df = snps_df.loc[~matches]
+                    mismatches.extend(zip(mismatched_df.index.tolist(), mismatched_df['Reference_Allele'].tolist()))
+
+                # Keep the SNPs that match the reference nucleotide, adding the file metadata columns
+                saved_df = snps_df.loc[matches].assign(**{column: line[column] for column in METADATA_COLUMNS})
+
+                # Write the saved mutations of the chunk as tab separated rows
+                fh_part.write(saved_df.to_csv(sep='\t', header=False, index=False, columns=MUTATIONS_HEADER, na_rep='nan', lineterminator='\n').encode('utf-8'))
+
+                # Count the rejected mutations of each classification and type, and add the chunk counts
+                rejected_counts.append(sample_df.loc[~is_snp, ['Variant_Classification', 'Variant_Type']].value_counts())
+                mismatched += int((~matches).sum())
+                file_saved_mutations += len(saved_df)
+                file_total_mutations += len(sample_df)
+
+    # Remove the temporary file if the file could not be validated
+    except BaseException:
+        os.remove(part_path)
+        raise
+
+    # Sum the rejected mutations of each classification and type across the chunks
+    rejected = pd.concat(rejected_counts).groupby(level=[0, 1], observed=True).sum().sort_values(ascending=False, kind='stable')
+
+    return part_path, rejected[rejected > 0], mismatched, mismatches, file_saved_mutations, file_total_mutations
 
 
 def main():
@@ -118,23 +328,33 @@ def main():
 
     # Set up logging
     logfile = "mutationvalidation.log"
+    log_format = '%(asctime)s  %(message)s'
+
+    # Buffer the log file records in memory and write them in batches, flushing right away on 
+    # errors and at exit
+    file_handler = logging.FileHandler(f"logs/{datetime.now().strftime("%Y%m%d")}_{logfile}")
+    file_handler.setFormatter(logging.Formatter(log_format))
+    memory_handler = MemoryHandler(10_000, flushLevel=logging.ERROR, target=file_handler)
+    atexit.register(memory_handler.flush)
 
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s  %(message)s',
+        format=log_format,
         handlers=[
-            logging.FileHandler(f"logs/{datetime.now().strftime("%Y%m%d")}_{logfile}"),
+            memory_handler,
             logging.StreamHandler(sys.stdout)
         ]
     )
 
-    # Create filehandle for the mutations CSV file and add the header
-    fh_mutations = open("input_data/mutations.csv", "w")
-    fh_mutations.write("file_path\tproject_id\tproject_name\tdisease_type\tprimary_site\tHugo_Symbol\tEntrez_Gene_Id\tChromosome\tStart_Position\tEnd_Position\tStrand\tVariant_Classification\tVariant_Type\tCCDS\n")
+    # Create a buffered binary filehandle for the mutations CSV file, which is written as pre-encoded 
+    # blocks of rows, and add the header
+    fh_mutations = open("input_data/mutations.csv", "wb", buffering=1<<20)
+    fh_mutations.write(("\t".join(MUTATIONS_HEADER) + "\n").encode('utf-8'))
 
-    # Create filehandle for the raw counts CSV file and add the header
-    fh_counts = open("input_data/raw_counts.csv", "w")
-    fh_counts.write("file_path\tsaved_mutations\ttotal_mutations\n")
+    # Create a buffered filehandle and tab separated writer for the raw counts CSV file and add the header
+    fh_counts = open("input_data/raw_counts.csv", "w", buffering=1<<20, newline='')
+    counts_writer = csv.writer(fh_counts, delimiter='\t', lineterminator='\n')
+    counts_writer.writerow(COUNTS_HEADER)
 
     logger = logging.getLogger(__name__) 
     
@@ -145,67 +365,66 @@ def main():
     total_mutations = 0
     saved_mutations = 0
 
-    # Iterate through the files found in the metadata file
-    for line in metadata:
-
-        # Import the MAF file
-        sample_df = import_maf(f"maf_files/{line[0]}")
-
-        # Initialize the genome kit Genome object
-        genome = Genome('hg38')
-
-        # Initialize the counts for the file
-        file_total_mutations = 0
-        file_saved_mutations = 0
-
-        logger.info(f"{'='*60}")
-        logger.info(f"File: {line[0]}")
-
-        # If the file is whole exon sequencing
-        if line[4] == "WXS":
-
-            # Iterate through the rows of the MAF
-            for index, row in sample_df.iterrows():
-                
-                # Reject and log mutations that are not missense or silent SNPs
-                if row['Variant_Classification'] not in ['Missense_Mutation', 'Silent'] or row['Variant_Type'] != 'SNP':
-                    logger.info(f"    Index: {index} not a Silent or Missense SNP")
-
-                # Check if the allele nucleotide matches the reference nucleotide
-                elif check_nucleotide(genome, row['Chromosome'], row['Start_Position'], row['Strand'], row['Reference_Allele']):
-
-                    # Write the mutation to the mutations file
-                    fh_mutations.write(f"{line[0]}\t{line[6]}\t{line[7]}\t{line[8]}\t{line[9]}\t{row['Hugo_Symbol']}\t{row['Entrez_Gene_Id']}\t{row['Chromosome']}\t{row['Start_Position']}\t{row['End_Position']}\t{row['Strand']}\t{row['Variant_Classification']}\t{row['Variant_Type']}\t{row['CCDS']}\n")
-                    
-                    # Add one the file saved mutations
-                    file_saved_mutations += 1
-
-                # If the allele nucleotide does not match, do not add
-                else:
-                    logger.info(f"    Index: {index} DOES NOT MATCH: Reference Allele ({row['Reference_Allele']}) does not match Genome hg38")
-
-                # Add one to the file total mutations
-                file_total_mutations += 1
-
-            # Log number of mutations saved and total 
-            logger.info(f"File {line[0]} Saved Mutations = {file_saved_mutations}")
-            logger.info(f"File {line[0]} Total Mutations = {file_total_mutations}")
-            logger.info(f"{'='*60}\n")
-
-            # Write to the raw count file the number of saved and total mutations for the file
-            fh_counts.write(f"{line[0]}\t{file_saved_mutations}\t{file_total_mutations}\n")
-
-            # Add the file total and saved to the total and saved variables and reset the file variables
-            saved_mutations += file_saved_mutations
-            total_mutations += file_total_mutations
-            file_saved_mutations = 0
-            file_total_mutations = 0
-        
-        # If not WXS, skip
-        else: 
-            logger.info(f"    File {line[0]} is not a Whole Exome Sequencing (WXS) project and was not saved")
-            logger.info(f"{'='*60}\n")
-    
+    # Split the files into whole exon sequencing files and excluded files before iterating
+    is_wxs = metadata['experimental_strategy'] == "WXS"
+    excluded = metadata.loc[~is_wxs, 'file_path']
+
+    # Log the files that are not WXS in a single message, they are not imported
+    if not excluded.empty:
+        logger.info("Files that are not Whole Exome Sequencing (WXS) projects and were not saved:\n    " + "\n    ".join(excluded))
+
+    # Validate the WXS files in parallel, loading one Genome object per worker process, and 
+    # handle the results of the files in metadata order
+    wxs_lines = metadata.loc[is_wxs].to_dict('records')
+    max_workers = max(1, min(len(wxs_lines), os.cpu_count() or 1))
+
+    # Only have the workers return the mismatched SNPs if they will be logged
+    keep_mismatches = logger.isEnabledFor(logging.DEBUG)
+
+    # The temporary files of the saved mutations are written to a directory owned by the main process,
+    # so that every one of them is removed even if a file fails or the run is interrupted
+    with tempfile.TemporaryDirectory(dir="input_data") as part_dir, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=('hg38',)) as executor:
+        try:
+            for line, result in zip(wxs_lines, executor.map(process_maf, wxs_lines, repeat(part_dir), repeat(keep_mismatches))):
+                part_path, rejected, mismatched, mismatches, file_saved_mutations, file_total_mutations = result
+
+                logger.info(SEP)
+                logger.info(f"File: {line['file_path']}")
+
+                # Append the saved mutations of the file to the mutations file and remove the temporary file
+                with open(part_path, "rb") as fh_part:
+                    shutil.copyfileobj(fh_part, fh_mutations, length=1<<20)
+                os.remove(part_path)
+
+                # Log at debug level the SNPs whose allele nucleotide does not match the reference nucleotide,
+                # logging happens here in the main process so the records reach the log file
+                for index, reference_allele in mismatches:
+                    logger.debug("    Index: %d DOES NOT MATCH: Reference Allele (%s) does not match Genome hg38", index, reference_allele)
+
+                # Log the number of rejected mutations of each classification and type, and the number of 
+                # mismatched reference alleles, once for the file
+                for (classification, variant_type), count in rejected.items():
+                    logger.info("    %d %s %s mutations are not Silent or Missense SNPs", count, classification, variant_type)
+                logger.info("    %d reference alleles do not match Genome hg38", mismatched)
+
+                # Log number of mutations saved and total 
+                logger.info(f"File {line['file_path']} Saved Mutations = {file_saved_mutations}")
+                logger.info(f"File {line['file_path']} Total Mutations = {file_total_mutations}")
+                logger.info("%s\n", SEP)
+
+                # Write to the raw count file the number of saved and total mutations for the file
+                counts_writer.writerow([line['file_path'], file_saved_mutations, file_total_mutations])
+
+                # Add the file total and saved to the total and saved variables
+                saved_mutations += file_saved_mutations
+                total_mutations += file_total_mutations
+
+        # If a file fails or the run is interrupted, cancel the files that have not started yet
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
     # Write number of saved and total mutations across all files
     logger.info(f"Saved {saved_mutations} mutations out of {total_mutations}")
 